@@ -1,9 +1,98 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 from collections import defaultdict
 import math
+import threading
+import time
+import numpy as np
+import orjson
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
+
+class OrjsonProvider(JSONProvider):
+    """
+    JSON provider that serializes and parses with orjson instead of the standard library.
+    """
+
+    def dumps(self, obj, **kwargs):
+        """
+        Serializes an object to a JSON string.
+
+        Parameters:
+        obj : object
+            The object to serialize; NumPy values are supported
+
+        Returns:
+        str: The JSON document
+        """
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+    def loads(self, s, **kwargs):
+        """
+        Parses a JSON document.
+
+        Parameters:
+        s : str or bytes
+            The JSON document
+
+        Returns:
+        object: The parsed value
+        """
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Length of the VWSP window in nanoseconds (5 minutes)
+WINDOW_NS = 5 * 60 * 1_000_000_000
+
+# How far back trades are kept for time-range queries, in nanoseconds (60 minutes)
+RETENTION_NS = 60 * 60 * 1_000_000_000
+
+# Seconds a computed GBCE All Share Index may be served without recomputing
+GBCE_CACHE_TTL = 0.5
+
+# Slices up to this many trades are reduced in Python rather than NumPy
+SMALL_SLICE_SIZE = 16
+
+# Bumped whenever any stock records a trade; invalidates the cached index
+_trade_version = 0
+_gbce_cache = {"version": -1, "time": 0.0, "value": None}
+
+class Trade:
+    """
+    A class to represent a single trade.
+
+    Attributes:
+    timestamp : datetime
+        The time at which the trade occurred
+    quantity : int
+        Number of shares traded
+    indicator : str
+        Buy or sell indicator
+    price : float
+        Price at which the trade occurred
+    """
+
+    __slots__ = ('timestamp', 'quantity', 'indicator', 'price')
+
+    def __init__(self, timestamp, quantity, indicator, price):
+        """
+        Constructs all the necessary attributes for the Trade object.
+
+        Parameters:
+        timestamp : datetime
+            The time at which the trade occurred
+        quantity : int
+            Number of shares traded
+        indicator : str
+            Buy or sell indicator
+        price : float
+            Price at which the trade occurred
+        """
+        self.timestamp = timestamp
+        self.quantity = quantity
+        self.indicator = indicator
+        self.price = price
 
 class Stock:
     """
@@ -21,9 +110,15 @@ class Stock:
     par_value : float
         Par value of the stock in pennies
     trades : list
-        List to store trades of the stock
+        Recent trades of the stock, rebuilt from the column arrays below;
+        trades older than the retention period are eventually discarded
     """
 
+    # Initial number of trade slots allocated per stock
+    INITIAL_CAPACITY = 64
+    # Number of trades older than the retention period tolerated before they are dropped
+    PRUNE_THRESHOLD = 1024
+
     def __init__(self, symbol, stock_type, last_dividend, fixed_dividend, par_value):
         """
         Constructs all the necessary attributes for the Stock object.
@@ -45,7 +140,64 @@ class Stock:
         self.last_dividend = last_dividend
         self.fixed_dividend = fixed_dividend
         self.par_value = par_value
-        self.trades = []
+        # Dividend used by the yield and P/E formulas, resolved once from the stock type
+        self._dividend = last_dividend if stock_type == "Common" else fixed_dividend * par_value
+        # Trades are kept as parallel arrays (one column per field) so that
+        # aggregations run as vectorized reductions; only the first _n slots are used.
+        self._ts = np.empty(self.INITIAL_CAPACITY, dtype='int64')
+        self._px = np.empty(self.INITIAL_CAPACITY, dtype='float64')
+        self._qty = np.empty(self.INITIAL_CAPACITY, dtype='int64')
+        self._ind = []
+        self._n = 0
+        # Trades in [_start, _n) fall inside the 5-minute window; running totals over
+        # that range let the VWSP be read without re-summing the window.
+        self._start = 0
+        self._sum_pq = 0.0
+        self._sum_q = 0
+        # Bumped on every recorded trade; used to invalidate the cached VWSP
+        self.version = 0
+        self._vwsp_cache = None
+        # Guards this stock's trade storage when requests are served from several
+        # threads, so trades on different stocks do not wait on each other.
+        # Reentrant so the module-level calculations can hold it across method calls.
+        self._lock = threading.RLock()
+
+    @property
+    def trades(self):
+        """
+        List of recorded trades.
+
+        Returns:
+        list: Trade objects in timestamp order
+        """
+        with self._lock:
+            return self._trades_in(slice(0, self._n))
+
+    def _trades_in(self, window):
+        """
+        Copies a range of the trade arrays out as Trade objects. Must be called
+        with self._lock held.
+
+        Parameters:
+        window : slice
+            Range of the trade arrays
+
+        Returns:
+        list: Trade objects in timestamp order
+        """
+        return [
+            Trade(_from_ns(int(ts)), int(qty), ind, float(px))
+            for ts, qty, ind, px in zip(self._ts[window], self._qty[window], self._ind[window], self._px[window])
+        ]
+
+    def _grow(self):
+        """
+        Doubles the capacity of the trade arrays so appends stay amortized O(1).
+        """
+        capacity = 2 * len(self._ts)
+        self._ts = np.resize(self._ts, capacity)
+        self._px = np.resize(self._px, capacity)
+        self._qty = np.resize(self._qty, capacity)
 
     def record_trade(self, timestamp, quantity, indicator, price):
         """
@@ -61,17 +213,276 @@ class Stock:
         price : float
             Price at which the trade occurred
         """
-        self.trades.append({"timestamp": timestamp, "quantity": quantity, "indicator": indicator, "price": price})
+        global _trade_version
+        # Convert to the column types before touching the arrays, so a value that
+        # does not fit (e.g. OverflowError) leaves the stock unchanged.
+        try:
+            ts = int(np.int64(_to_ns(timestamp)))
+            quantity = int(np.int64(quantity))
+            price = float(np.float64(price))
+        except OverflowError:
+            raise OverflowError("Trade timestamp or quantity is out of range") from None
+        with self._lock:
+            now_ns = time.time_ns()
+            cutoff_ns = _window_cutoff_ns(now_ns)
+            self._evict(cutoff_ns)
+            # Trades older than the retention period are all before the window start
+            expired = int(np.searchsorted(self._ts[:self._start], now_ns - RETENTION_NS, side='left'))
+            if expired > self.PRUNE_THRESHOLD:
+                self._prune(expired)
+            if self._n == len(self._ts):
+                self._grow()
+            n = self._n
+            # Keep the timestamp column sorted so windows can be found by binary search.
+            # Trades normally arrive in time order; a late one is shifted into place.
+            if n and ts < self._ts[n - 1]:
+                i = int(np.searchsorted(self._ts[:n], ts, side='right'))
+                self._ts[i + 1:n + 1] = self._ts[i:n]
+                self._px[i + 1:n + 1] = self._px[i:n]
+                self._qty[i + 1:n + 1] = self._qty[i:n]
+            else:
+                i = n
+            self._ts[i] = ts
+            self._px[i] = price
+            self._qty[i] = quantity
+            self._ind.insert(i, indicator)
+            self._n += 1
+            if ts >= cutoff_ns:
+                self._sum_pq += price * quantity
+                self._sum_q += quantity
+            else:
+                self._start += 1
+            self.version += 1
+            _trade_version += 1
+
+    def _evict(self, cutoff_ns):
+        """
+        Moves the window start past trades older than the cutoff and removes
+        their contribution from the running totals.
 
-    def get_trades_in_last_5_minutes(self):
+        Parameters:
+        cutoff_ns : int
+            Oldest timestamp, in nanoseconds since the epoch, still inside the window
+        """
+        start, n = self._start, self._n
+        end = start + int(np.searchsorted(self._ts[start:n], cutoff_ns, side='left'))
+        if end == start:
+            return
+        total_pq, total_q = _price_quantity_totals(self._px[start:end], self._qty[start:end])
+        self._sum_q -= total_q
+        if self._sum_q == 0:
+            # Reset rather than subtract so float rounding cannot accumulate
+            self._sum_pq = 0.0
+        elif 2 * total_pq >= self._sum_pq:
+            # Most of the total is leaving the window; subtracting it would cancel
+            # away the precision of what remains, so re-sum the remaining trades
+            self._sum_pq = _price_quantity_totals(self._px[end:n], self._qty[end:n])[0]
+        else:
+            self._sum_pq -= total_pq
+        self._start = end
+
+    def _prune(self, count):
+        """
+        Drops the oldest trades, moving the remaining ones into right-sized arrays
+        so memory tracks the retention period rather than the lifetime.
+
+        Parameters:
+        count : int
+            Number of trades to drop; all of them must be before the window start
+        """
+        n = self._n
+        capacity = max(self.INITIAL_CAPACITY, 2 * (n - count))
+        for name in ('_ts', '_px', '_qty'):
+            column = getattr(self, name)
+            pruned = np.empty(capacity, dtype=column.dtype)
+            pruned[:n - count] = column[count:n]
+            setattr(self, name, pruned)
+        del self._ind[:count]
+        self._n = n - count
+        self._start -= count
+
+    def get_trades_in_last_5_minutes(self, now_ns=None):
         """
         Retrieves all trades that occurred in the last 5 minutes.
 
+        Parameters:
+        now_ns : int, optional
+            Time in nanoseconds since the epoch the window ends at; the clock if omitted
+
         Returns:
-        list: Trades from the last 5 minutes
+        list: Trade objects from the last 5 minutes, in timestamp order
+
+        Raises:
+        ValueError: If the window starts before the retention period
+        """
+        with self._lock:
+            return self._trades_in(self._window_slice(now_ns))
+
+    def get_trades_between(self, start, end):
+        """
+        Retrieves all trades that occurred in a time range. Ranges may reach
+        back at most RETENTION_NS, since older trades are discarded.
+
+        Parameters:
+        start : datetime
+            Start of the range (inclusive)
+        end : datetime
+            End of the range (exclusive)
+
+        Returns:
+        list: Trade objects from the time range, in timestamp order
+
+        Raises:
+        ValueError: If the range starts before the retention period
+        """
+        with self._lock:
+            return self._trades_in(self._range_slice(start, end))
+
+    def _window_slice(self, now_ns=None):
+        """
+        Selects the trades that occurred in the last 5 minutes. Must be called
+        with self._lock held, and the slice is only valid until it is released,
+        since recording a trade can move the rows.
+
+        Expired trades are only ever evicted using the real clock; a supplied
+        now_ns just selects a window and does not change the stock.
+
+        Parameters:
+        now_ns : int, optional
+            Time in nanoseconds since the epoch the window ends at; the clock if omitted
+
+        Returns:
+        slice: Range of the trade arrays holding trades from the last 5 minutes
+
+        Raises:
+        ValueError: If the window starts before the retention period
+        """
+        clock_ns = time.time_ns()
+        self._evict(_window_cutoff_ns(clock_ns))
+        if now_ns is None:
+            return slice(self._start, self._n)
+        cutoff_ns = _window_cutoff_ns(now_ns)
+        if cutoff_ns < clock_ns - RETENTION_NS:
+            raise ValueError(f"Trades are only kept for the last {RETENTION_NS // 60_000_000_000} minutes")
+        start = int(np.searchsorted(self._ts[:self._n], cutoff_ns, side='left'))
+        return slice(start, self._n)
+
+    def _range_slice(self, start, end):
         """
-        now = datetime.now()
-        return [trade for trade in self.trades if trade['timestamp'] >= now - timedelta(minutes=5)]
+        Selects the trades that occurred in a time range, using binary search
+        on the sorted timestamps so any window length costs O(log n). Must be
+        called with self._lock held, and the slice is only valid until it is
+        released, since recording a trade can move the rows.
+
+        Parameters:
+        start : datetime
+            Start of the range (inclusive)
+        end : datetime
+            End of the range (exclusive)
+
+        Returns:
+        slice: Range of the trade arrays holding trades from the time range
+
+        Raises:
+        ValueError: If the range starts before the retention period
+        """
+        start_ns = _to_ns(start)
+        if start_ns < time.time_ns() - RETENTION_NS:
+            raise ValueError(f"Trades are only kept for the last {RETENTION_NS // 60_000_000_000} minutes")
+        timestamps = self._ts[:self._n]
+        first = int(np.searchsorted(timestamps, start_ns, side='left'))
+        last = int(np.searchsorted(timestamps, _to_ns(end), side='left'))
+        return slice(first, max(first, last))
+
+def _window_cutoff_ns(now_ns=None):
+    """
+    Returns the start of the 5-minute VWSP window.
+
+    Parameters:
+    now_ns : int, optional
+        Current time in nanoseconds since the epoch; read from the clock if omitted
+
+    Returns:
+    int: Nanoseconds since the epoch five minutes before now
+    """
+    if now_ns is None:
+        now_ns = time.time_ns()
+    return now_ns - WINDOW_NS
+
+def _price_quantity_totals(prices, quantities):
+    """
+    Sums price * quantity and quantity over matching slices of the trade arrays.
+
+    Short slices are summed in a plain loop, which beats the fixed per-call
+    overhead of NumPy; longer ones use a single dot product.
+
+    Parameters:
+    prices : numpy.ndarray
+        Trade prices
+    quantities : numpy.ndarray
+        Trade quantities
+
+    Returns:
+    tuple: (sum of price * quantity, sum of quantity)
+    """
+    if len(quantities) <= SMALL_SLICE_SIZE:
+        total_pq = 0.0
+        total_q = 0
+        for price, quantity in zip(prices.tolist(), quantities.tolist()):
+            total_pq += price * quantity
+            total_q += quantity
+        return total_pq, total_q
+    # Quantities are summed as Python ints, as the running totals are, so a large
+    # batch cannot wrap around the way an int64 NumPy sum would
+    return float(np.dot(prices, quantities)), sum(quantities.tolist())
+
+def _parse_timestamp(value):
+    """
+    Parses a trade timestamp in the format '%Y-%m-%d %H:%M:%S'.
+
+    fromisoformat is much faster than strptime but also accepts other ISO 8601
+    forms (date only, UTC offsets, fractional seconds), so the layout is checked first.
+
+    Parameters:
+    value : str
+        The timestamp string
+
+    Returns:
+    datetime: The parsed timestamp
+    """
+    if not isinstance(value, str):
+        raise TypeError("timestamp must be a string")
+    if (len(value) != 19 or value[4] != '-' or value[7] != '-' or value[10] != ' '
+            or value[13] != ':' or value[16] != ':'):
+        raise ValueError(f"timestamp {value!r} does not match format '%Y-%m-%d %H:%M:%S'")
+    return datetime.fromisoformat(value)
+
+def _to_ns(timestamp):
+    """
+    Converts a datetime to integer nanoseconds since the epoch.
+
+    Parameters:
+    timestamp : datetime
+        The datetime to convert
+
+    Returns:
+    int: Nanoseconds since the epoch
+    """
+    return int(timestamp.timestamp()) * 1_000_000_000 + timestamp.microsecond * 1_000
+
+def _from_ns(ns):
+    """
+    Converts integer nanoseconds since the epoch back to a local datetime.
+
+    Parameters:
+    ns : int
+        Nanoseconds since the epoch
+
+    Returns:
+    datetime: The corresponding datetime, truncated to microseconds
+    """
+    seconds, remainder = divmod(ns, 1_000_000_000)
+    return datetime.fromtimestamp(seconds).replace(microsecond=remainder // 1_000)
 
 def calculate_dividend_yield(stock, price):
     """
@@ -88,10 +499,7 @@ def calculate_dividend_yield(stock, price):
     """
     if price == 0:
         return None  # Avoid division by zero
-    if stock.stock_type == "Common":
-        return stock.last_dividend / price
-    elif stock.stock_type == "Preferred":
-        return (stock.fixed_dividend * stock.par_value) / price
+    return stock._dividend / price
 
 def calculate_pe_ratio(stock, price):
     """
@@ -108,39 +516,84 @@ def calculate_pe_ratio(stock, price):
     """
     if price == 0:
         return None  # Avoid division by zero
-    dividend = stock.last_dividend if stock.stock_type == "Common" else stock.fixed_dividend * stock.par_value
+    dividend = stock._dividend
     return price / dividend if dividend != 0 else None
 
-def calculate_volume_weighted_stock_price(stock):
+def calculate_volume_weighted_stock_price(stock, now_ns=None):
     """
     Calculates the Volume Weighted Stock Price based on trades in the past 5 minutes.
 
     Parameters:
     stock : Stock
         The stock object
+    now_ns : int, optional
+        Time in nanoseconds since the epoch the window ends at; the clock if omitted.
+        It only selects the window and never evicts trades from the stock.
 
     Returns:
     float: The volume weighted stock price
     """
-    trades = stock.get_trades_in_last_5_minutes()
-    total_traded_price_quantity = sum(trade['price'] * trade['quantity'] for trade in trades)
-    total_quantity = sum(trade['quantity'] for trade in trades)
-    return total_traded_price_quantity / total_quantity if total_quantity != 0 else 0
+    if now_ns is None:
+        now_ns = time.time_ns()
+    # Reuse the last result if no trade was recorded within the same second
+    second = now_ns // 1_000_000_000
+    cached = stock._vwsp_cache
+    if cached is not None and cached[0] == stock.version and cached[1] == second:
+        return cached[2]
+    with stock._lock:
+        window = stock._window_slice(now_ns)
+        if window.start == stock._start:
+            # The window matches the running totals, as it does for the current time
+            vwsp = stock._sum_pq / stock._sum_q if stock._sum_q != 0 else 0
+        else:
+            total_traded_price_quantity, total_quantity = _price_quantity_totals(stock._px[window], stock._qty[window])
+            vwsp = total_traded_price_quantity / total_quantity if total_quantity != 0 else 0
+        stock._vwsp_cache = (stock.version, second, vwsp)
+        return vwsp
+
+def calculate_volume_weighted_price_between(stock, start, end):
+    """
+    Calculates the Volume Weighted Stock Price over an arbitrary time range.
+
+    Parameters:
+    stock : Stock
+        The stock object
+    start : datetime
+        Start of the range (inclusive)
+    end : datetime
+        End of the range (exclusive)
+
+    Returns:
+    float: The volume weighted stock price over the range
+    """
+    with stock._lock:
+        window = stock._range_slice(start, end)
+        total_traded_price_quantity, total_quantity = _price_quantity_totals(stock._px[window], stock._qty[window])
+        return total_traded_price_quantity / total_quantity if total_quantity != 0 else 0
 
 def calculate_gbce_all_share_index(stocks):
     """
     Calculates the GBCE All Share Index using the geometric mean of the Volume Weighted Stock Price for all stocks.
 
     Parameters:
-    stocks : list
-        List of stock objects
+    stocks : iterable
+        Stock objects, e.g. a view of the stocks dictionary
 
     Returns:
-    float: The GBCE All Share Index
+    float: The GBCE All Share Index, or 0 if no stock has traded in the past 5 minutes
     """
-    vwsp_values = [calculate_volume_weighted_stock_price(stock) for stock in stocks]
-    product = math.prod(vwsp_values)
-    return product ** (1 / len(vwsp_values))
+    # Read the clock once so every stock is measured against the same window
+    now_ns = time.time_ns()
+    # Stocks without recent trades have no price and are left out; averaging logs
+    # avoids the overflow/underflow of multiplying many prices together.
+    total = 0.0
+    count = 0
+    for stock in stocks:
+        vwsp = calculate_volume_weighted_stock_price(stock, now_ns)
+        if vwsp > 0:
+            total += math.log(vwsp)
+            count += 1
+    return math.exp(total / count) if count else 0
 
 # In-memory storage for stocks
 stocks = {
@@ -214,18 +667,22 @@ def record_trade(symbol):
     Returns:
     json: JSON object containing a success message or an error message
     """
-    data = request.get_json()
     stock = stocks.get(symbol)
     if stock:
+        # Same contract as request.get_json(): only JSON bodies are accepted
+        if not request.is_json:
+            return jsonify({"error": "Request body must be JSON"}), 415
         try:
-            timestamp = datetime.strptime(data['timestamp'], '%Y-%m-%d %H:%M:%S')
+            data = orjson.loads(request.get_data())
+            timestamp = _parse_timestamp(data['timestamp'])
             quantity = int(data['quantity'])
             indicator = data['indicator']
             price = float(data['price'])
-        except (ValueError, KeyError) as e:
+            # Timestamps past 2262 or quantities beyond 64 bits do not fit the trade arrays
+            stock.record_trade(timestamp, quantity, indicator, price)
+        except (ValueError, KeyError, TypeError, OverflowError) as e:
             return jsonify({"error": str(e)}), 400
 
-        stock.record_trade(timestamp, quantity, indicator, price)
         return jsonify({"message": "Trade recorded successfully"})
     return jsonify({"error": "Stock not found"}), 404
 
@@ -254,7 +711,13 @@ def get_gbce_all_share_index():
     Returns:
     json: JSON object containing the GBCE All Share Index
     """
-    result = calculate_gbce_all_share_index(list(stocks.values()))
+    now = time.monotonic()
+    if _gbce_cache["version"] == _trade_version and now - _gbce_cache["time"] < GBCE_CACHE_TTL:
+        result = _gbce_cache["value"]
+    else:
+        version = _trade_version
+        result = calculate_gbce_all_share_index(stocks.values())
+        _gbce_cache.update(version=version, time=now, value=result)
     return jsonify({"gbce_all_share_index": result})
 
 if __name__ == '__main__':
@@ -1,7 +1,11 @@
+import time
+import numpy as np
+import orjson
+import app as app_module
 import pytest
 import requests
-from datetime import datetime
-from app import app, stocks, calculate_dividend_yield, calculate_pe_ratio, calculate_volume_weighted_stock_price, calculate_gbce_all_share_index
+from datetime import datetime, timedelta
+from app import app, stocks, Stock, SMALL_SLICE_SIZE, _price_quantity_totals, calculate_dividend_yield, calculate_pe_ratio, calculate_volume_weighted_stock_price, calculate_volume_weighted_price_between, calculate_gbce_all_share_index
 
 BASE_URL = "http://127.0.0.1:5000"
 
@@ -32,13 +36,53 @@ def test_record_trade(client):
     assert response.status_code == 200
     assert response.json["message"] == "Trade recorded successfully"
     # Check if trade was recorded
-    trades = stocks['POP'].trades
-    assert trades[-1] == {
-        "timestamp": datetime.strptime(trade_data["timestamp"], '%Y-%m-%d %H:%M:%S'),
-        "quantity": trade_data["quantity"],
-        "indicator": trade_data["indicator"],
-        "price": trade_data["price"]
+    trade = stocks['POP'].trades[-1]
+    assert trade.timestamp == datetime.strptime(trade_data["timestamp"], '%Y-%m-%d %H:%M:%S')
+    assert trade.quantity == trade_data["quantity"]
+    assert trade.indicator == trade_data["indicator"]
+    assert trade.price == trade_data["price"]
+
+def test_record_trade_invalid_body(client):
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    bodies = [
+        "not json",
+        "[1, 2]",
+        '{"timestamp": 1700000000, "quantity": 10, "indicator": "buy", "price": 100}',
+        '{"timestamp": "2024-01-01", "quantity": 10, "indicator": "buy", "price": 100}',
+        '{"timestamp": "2024-01-01T10:00:00+01:00", "quantity": 10, "indicator": "buy", "price": 100}',
+        '{"quantity": 10, "indicator": "buy", "price": 100}',
+        '{"timestamp": "%s", "quantity": "ten", "indicator": "buy", "price": 100}' % timestamp,
+    ]
+    for body in bodies:
+        response = client.post('/record_trade/POP', data=body, content_type='application/json')
+        assert response.status_code == 400
+        assert "error" in response.json
+
+def test_record_trade_requires_json_content_type(client):
+    trade_data = {
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "quantity": 10,
+        "indicator": "buy",
+        "price": 100
     }
+    versions = stocks['POP'].version
+    response = client.post('/record_trade/POP', data=orjson.dumps(trade_data), content_type='text/plain')
+    assert response.status_code == 415
+    assert stocks['POP'].version == versions
+
+def test_record_trade_out_of_range(client):
+    versions = stocks['TEA'].version
+    for timestamp, quantity in (("2300-01-01 00:00:00", 10), (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), str(10**20))):
+        trade_data = {
+            "timestamp": timestamp,
+            "quantity": quantity,
+            "indicator": "buy",
+            "price": 100
+        }
+        response = client.post('/record_trade/TEA', json=trade_data)
+        assert response.status_code == 400
+        assert "out of range" in response.json["error"]
+    assert stocks['TEA'].version == versions
 
 def test_volume_weighted_stock_price(client):
     # First, record a trade
@@ -58,7 +102,171 @@ def test_volume_weighted_stock_price(client):
 def test_gbce_all_share_index(client):
     response = client.get('/gbce_all_share_index')
     assert response.status_code == 200
-    assert response.json["gbce_all_share_index"] == calculate_gbce_all_share_index(list(stocks.values()))
+    assert response.json["gbce_all_share_index"] == calculate_gbce_all_share_index(stocks.values())
+
+def test_gbce_all_share_index_invalidated_by_trade(client):
+    client.get('/gbce_all_share_index')
+    trade_data = {
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "quantity": 5,
+        "indicator": "sell",
+        "price": 250
+    }
+    client.post('/record_trade/JOE', json=trade_data)
+    # A new trade must not be hidden by the cached index
+    response = client.get('/gbce_all_share_index')
+    assert response.json["gbce_all_share_index"] == calculate_gbce_all_share_index(stocks.values())
+
+def test_gbce_all_share_index_cache_expires(client, monkeypatch):
+    monkeypatch.setattr(app_module, "GBCE_CACHE_TTL", 60)
+    expected = client.get('/gbce_all_share_index').json["gbce_all_share_index"]
+    # Within the TTL and with no new trades the cached value is served as is
+    monkeypatch.setitem(app_module._gbce_cache, "value", -1)
+    assert client.get('/gbce_all_share_index').json["gbce_all_share_index"] == -1
+    # Once the TTL has passed the index is recomputed even without new trades
+    monkeypatch.setattr(app_module, "GBCE_CACHE_TTL", 0)
+    assert client.get('/gbce_all_share_index').json["gbce_all_share_index"] == expected
+
+def test_volume_weighted_stock_price_window():
+    stock = Stock("TST", "Common", 5, 0, 100)
+    now = datetime.now()
+    stock.record_trade(now - timedelta(minutes=1), 10, "buy", 100)
+    stock.record_trade(now - timedelta(minutes=10), 50, "sell", 500)
+    stock.record_trade(now - timedelta(minutes=2), 30, "buy", 200)
+    # Late trades are kept in timestamp order and old ones fall outside the window
+    assert [trade.price for trade in stock.trades] == [500, 200, 100]
+    assert [trade.price for trade in stock.get_trades_in_last_5_minutes()] == [200, 100]
+    assert [trade.price for trade in stock.get_trades_between(now - timedelta(minutes=15), now - timedelta(minutes=1))] == [500, 200]
+    assert calculate_volume_weighted_stock_price(stock) == (10 * 100 + 30 * 200) / 40
+
+def test_record_trade_out_of_range_leaves_stock_unchanged():
+    stock = Stock("TST", "Common", 5, 0, 100)
+    now = datetime.now()
+    stock.record_trade(now - timedelta(minutes=1), 10, "buy", 100)
+    stock.record_trade(now, 20, "sell", 200)
+    with pytest.raises(OverflowError):
+        stock.record_trade(now - timedelta(minutes=2), 10**20, "buy", 300)
+    assert [(trade.quantity, trade.price) for trade in stock.trades] == [(10, 100), (20, 200)]
+    assert calculate_volume_weighted_stock_price(stock) == (10 * 100 + 20 * 200) / 30
+
+def test_volume_weighted_stock_price_cache():
+    stock = Stock("TST", "Common", 5, 0, 100)
+    now_ns = time.time_ns()
+    stock.record_trade(datetime.now(), 10, "buy", 100)
+    assert calculate_volume_weighted_stock_price(stock, now_ns) == 100
+    # A repeat call in the same second is served from the cache, not the running totals
+    stock._sum_pq += 1000
+    assert calculate_volume_weighted_stock_price(stock, now_ns) == 100
+    stock._sum_pq -= 1000
+    # A trade in the same second bumps the version and invalidates the cache
+    stock.record_trade(datetime.now(), 30, "sell", 200)
+    assert calculate_volume_weighted_stock_price(stock, now_ns) == (10 * 100 + 30 * 200) / 40
+
+def test_volume_weighted_stock_price_at_supplied_time():
+    stock = Stock("TST", "Common", 5, 0, 100)
+    now = datetime.now()
+    stock.record_trade(now - timedelta(minutes=7), 10, "buy", 100)
+    stock.record_trade(now - timedelta(minutes=1), 30, "sell", 200)
+    assert calculate_volume_weighted_stock_price(stock) == 200
+    # An earlier time still sees the trade already evicted for the current window
+    three_minutes_ago = time.time_ns() - 3 * 60 * 1_000_000_000
+    assert calculate_volume_weighted_stock_price(stock, three_minutes_ago) == (10 * 100 + 30 * 200) / 40
+    # A future time selects an empty window without evicting the current trades
+    in_ten_minutes = time.time_ns() + 10 * 60 * 1_000_000_000
+    assert calculate_volume_weighted_stock_price(stock, in_ten_minutes) == 0
+    assert calculate_volume_weighted_stock_price(stock) == 200
+
+def test_expired_trades_are_pruned():
+    stock = Stock("TST", "Common", 5, 0, 100)
+    stock.PRUNE_THRESHOLD = 2
+    now = datetime.now()
+    for minutes in (90, 80, 70):
+        stock.record_trade(now - timedelta(minutes=minutes), 10, "buy", 50)
+    stock.record_trade(now - timedelta(minutes=30), 10, "buy", 75)
+    stock.record_trade(now, 10, "buy", 100)
+    stock.record_trade(now, 30, "sell", 200)
+    # Trades older than the retention period are dropped; newer ones are kept
+    assert [trade.price for trade in stock.trades] == [75, 100, 200]
+    assert calculate_volume_weighted_stock_price(stock) == (10 * 100 + 30 * 200) / 40
+
+def test_volume_weighted_price_between_across_prune():
+    stock = Stock("TST", "Common", 5, 0, 100)
+    stock.PRUNE_THRESHOLD = 2
+    now = datetime.now()
+    for minutes, quantity, price in ((50, 10, 100), (40, 30, 200), (90, 10, 50), (80, 10, 50), (70, 10, 50)):
+        stock.record_trade(now - timedelta(minutes=minutes), quantity, "buy", price)
+    expected = (10 * 100 + 30 * 200) / 40
+    assert len(stock.trades) == 5
+    assert calculate_volume_weighted_price_between(stock, now - timedelta(minutes=55), now) == expected
+    # Crossing the prune threshold must not change the answer for a retained range
+    stock.record_trade(now, 20, "buy", 300)
+    assert [trade.price for trade in stock.trades] == [100, 200, 300]
+    assert calculate_volume_weighted_price_between(stock, now - timedelta(minutes=55), now) == expected
+    # Ranges reaching past the retention period are rejected rather than truncated
+    with pytest.raises(ValueError):
+        calculate_volume_weighted_price_between(stock, now - timedelta(minutes=95), now)
+
+def test_volume_weighted_price_between():
+    stock = Stock("TST", "Common", 5, 0, 100)
+    now = datetime.now()
+    for minutes, quantity, price in ((1, 10, 100), (3, 20, 200), (10, 30, 300)):
+        stock.record_trade(now - timedelta(minutes=minutes), quantity, "buy", price)
+    assert calculate_volume_weighted_price_between(stock, now - timedelta(minutes=2), now) == 100
+    assert calculate_volume_weighted_price_between(stock, now - timedelta(minutes=15), now - timedelta(minutes=2)) == (20 * 200 + 30 * 300) / 50
+    assert calculate_volume_weighted_price_between(stock, now, now - timedelta(minutes=15)) == 0
+
+def test_price_quantity_totals_large_slice():
+    prices = np.linspace(1, 50, 4 * SMALL_SLICE_SIZE)
+    quantities = np.arange(1, 4 * SMALL_SLICE_SIZE + 1)
+    total_pq, total_q = _price_quantity_totals(prices, quantities)
+    # Summing the same trades in slices short enough for the loop path gives the same totals
+    chunks = [
+        _price_quantity_totals(prices[i:i + SMALL_SLICE_SIZE], quantities[i:i + SMALL_SLICE_SIZE])
+        for i in range(0, len(prices), SMALL_SLICE_SIZE)
+    ]
+    assert total_q == sum(chunk[1] for chunk in chunks)
+    assert total_pq == pytest.approx(sum(chunk[0] for chunk in chunks))
+
+def test_evicting_large_quantities(monkeypatch):
+    stock = Stock("TST", "Common", 5, 0, 100)
+    now = datetime.now()
+    for _ in range(SMALL_SLICE_SIZE + 4):
+        stock.record_trade(now - timedelta(minutes=2), 2**62, "buy", 10)
+    stock.record_trade(now, 10, "sell", 20)
+    # Shrink the window so the large trades are evicted in a single batch
+    monkeypatch.setattr(app_module, "WINDOW_NS", 60 * 1_000_000_000)
+    assert calculate_volume_weighted_stock_price(stock) == 20
+    assert stock._sum_q == 10
+
+def test_volume_weighted_price_between_large_range():
+    stock = Stock("TST", "Common", 5, 0, 100)
+    now = datetime.now()
+    trades = [(i + 1, 100 + i) for i in range(2 * SMALL_SLICE_SIZE)]
+    for seconds, (quantity, price) in enumerate(trades):
+        stock.record_trade(now - timedelta(seconds=seconds), quantity, "buy", price)
+    expected = sum(quantity * price for quantity, price in trades) / sum(quantity for quantity, _ in trades)
+    assert calculate_volume_weighted_price_between(stock, now - timedelta(minutes=1), now + timedelta(seconds=1)) == pytest.approx(expected)
+
+def test_volume_weighted_price_between_large_quantities():
+    stock = Stock("TST", "Common", 5, 0, 100)
+    now = datetime.now()
+    for _ in range(SMALL_SLICE_SIZE + 4):
+        stock.record_trade(now - timedelta(minutes=2), 2**62, "buy", 10)
+    stock.record_trade(now, 10, "sell", 20)
+    # The quantity total exceeds int64 and must not wrap around
+    assert calculate_volume_weighted_price_between(stock, now - timedelta(minutes=3), now + timedelta(seconds=1)) == pytest.approx(10)
+
+def test_gbce_all_share_index_geometric_mean():
+    now = datetime.now()
+    traded = []
+    for symbol, price in (("AAA", 4), ("BBB", 16)):
+        stock = Stock(symbol, "Common", 5, 0, 100)
+        stock.record_trade(now, 10, "buy", price)
+        traded.append(stock)
+    # A stock with no trades in the window does not drag the index to zero
+    idle = Stock("CCC", "Common", 5, 0, 100)
+    assert calculate_gbce_all_share_index(traded + [idle]) == pytest.approx(8)
+    assert calculate_gbce_all_share_index([idle]) == 0
 
 if __name__ == "__main__":
     pytest.main()